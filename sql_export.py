@@ -2,7 +2,7 @@
 # 功能说明：
 # 1. 从指定文件读取SQL查询语句
 # 2. 连接Oracle数据库执行查询
-# 3. 根据查询结果行数自动分块导出Excel文件（超过50万行时分20万行/块）
+# 3. 默认流式导出Parquet文件；配置为xlsx时分块导出Excel文件（每20万行一个文件，多进程并行写入，结果不超过20万行时导出为单个output.xlsx）
 # 4. 全程日志记录（包含操作日志、错误追踪、资源释放状态）
 # 5. 自动创建缺失的SQL参数文件
 # 6. 支持运行时动态生成带时间戳的日志文件
@@ -11,30 +11,56 @@
 
 import os
 import sys
+import glob
+import itertools
+import threading
 import traceback
+import multiprocessing
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+from concurrent.futures import ProcessPoolExecutor
 import oracledb
-import sqlparse
-import pandas as pd
+import openpyxl
+from openpyxl.writer.excel import ExcelWriter
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from tqdm import tqdm
 import logging
 from datetime import datetime
 
+# Oracle Instant Client 目录：打包后的 EXE 使用 PyInstaller 的临时目录
+BASE_DIR = sys._MEIPASS if getattr(sys, 'frozen', False) else os.path.abspath(".")
+LIB_DIR = os.path.join(BASE_DIR, "instantclient_11_2")
+
+# 批量获取参数：加大每次网络往返获取的行数（prefetchrows需不小于arraysize+1）
+ARRAY_SIZE = 50_000
+PREFETCH_ROWS = ARRAY_SIZE + 1
+oracledb.defaults.arraysize = ARRAY_SIZE
+oracledb.defaults.prefetchrows = PREFETCH_ROWS
+SPLIT_SIZE = 200_000        # 每个Excel分块文件最大行数
+MAX_PENDING_CHUNKS = 2      # 同时等待写入的Excel分块上限（控制内存占用）
+DEFAULT_XLSX_COMPRESS_LEVEL = 6  # Excel压缩级别（0为不压缩，1-9为deflate级别）
+
+logger = logging.getLogger(__name__)
+
 # 日志系统初始化
 def setup_logging():
     """初始化日志系统，创建带时间戳的独立日志文件并配置输出格式"""
     log_filename = f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    logging.basicConfig(
-        filename=log_filename,          # 日志文件名
-        level=logging.INFO,             # 最低记录级别
-        format="%(asctime)s [%(levelname)s] %(message)s",  # 日志格式（时间+级别+消息）
-        datefmt="%Y-%m-%d %H:%M:%S"     # 时间格式
-    )
-    # 添加控制台输出处理器
+    # 文件输出处理器（首条日志写入时才打开文件）
+    file_handler = logging.FileHandler(log_filename, delay=True)
+    file_handler.setFormatter(logging.Formatter(
+        "%(asctime)s [%(levelname)s] %(message)s",  # 日志格式（时间+级别+消息）
+        datefmt="%Y-%m-%d %H:%M:%S"                 # 时间格式
+    ))
+    # 控制台输出处理器
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(logging.Formatter("%(message)s"))
-    logging.getLogger().addHandler(console_handler)
+    # 显式替换根日志器的处理器，确保每条日志只格式化输出一次
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)         # 最低记录级别
+    root.handlers = [file_handler, console_handler]
 
-setup_logging()  # 脚本启动时立即初始化日志
 def read_db_config():
     """从database.txt读取数据库配置，不存在则创建示例配置"""
     config = {}
@@ -44,8 +70,10 @@ def read_db_config():
             f.write("user=123\n")
             f.write("password=456\n")
             f.write("dsn=localhost:1521/orcl\n")
-        logging.info("database.txt不存在，已创建默认配置。")
-        logging.info("请编辑database.txt配置文件")
+            f.write("output_format=parquet\n")
+            f.write(f"xlsx_compress_level={DEFAULT_XLSX_COMPRESS_LEVEL}\n")
+        logger.info("database.txt不存在，已创建默认配置。")
+        logger.info("请编辑database.txt配置文件")
         sys.exit(0)
     # 读取配置文件
     with open('database.txt', 'r') as f:
@@ -62,157 +90,308 @@ def read_sql_from_file(file_path):
         # 自动创建缺失的SQL文件
         with open(file_path, "w", encoding="utf-8") as f:
             f.write("SELECT * FROM dual\n")
-        logging.info(f"文件 {file_path} 自动生成成功！")
+        logger.info(f"文件 {file_path} 自动生成成功！")
     # 读取文件内容并去除首尾空白字符
     with open(file_path, "r", encoding="utf-8") as f:
         return f.read().strip()
 
-def validate_sql(sql):
-    """SQL语法验证函数"""
+# 数值类型的列空值替换为0，其余列替换为''
+NUMERIC_TYPES = {
+    oracledb.DB_TYPE_NUMBER,
+    oracledb.DB_TYPE_BINARY_INTEGER,
+    oracledb.DB_TYPE_BINARY_FLOAT,
+    oracledb.DB_TYPE_BINARY_DOUBLE,
+}
+# 字符串类型的列需要去除\x1f控制字符
+STRING_TYPES = {
+    oracledb.DB_TYPE_VARCHAR,
+    oracledb.DB_TYPE_NVARCHAR,
+    oracledb.DB_TYPE_CHAR,
+    oracledb.DB_TYPE_NCHAR,
+}
+# 长文本类型的列按LONG字符串获取（CLOB/NCLOB不再返回LOB对象，LONG不受4000字符限制）
+LONG_TYPES = {
+    oracledb.DB_TYPE_LONG,
+    oracledb.DB_TYPE_CLOB,
+    oracledb.DB_TYPE_NCLOB,
+}
+
+def strip_unit_separator(value):
+    """去除字符串中的\\x1f控制字符（Excel不支持该字符）"""
+    return value.replace('\x1f', '')
+
+def output_type_handler(cursor, metadata):
+    """游标输出类型处理器：字符串及长文本列在驱动取数时即完成\\x1f清洗"""
+    if metadata.type_code in STRING_TYPES:
+        # 沿用列自身的类型与宽度，避免按默认4000字符分配取数缓冲区
+        return cursor.var(metadata.type_code, size=metadata.display_size,
+                          arraysize=cursor.arraysize, outconverter=strip_unit_separator)
+    if metadata.type_code in LONG_TYPES:
+        return cursor.var(oracledb.DB_TYPE_LONG, arraysize=cursor.arraysize, outconverter=strip_unit_separator)
+
+def strip_unit_separator_table(table):
+    """Arrow表的字符串列使用pyarrow计算内核批量去除\\x1f控制字符"""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            column = pc.replace_substring(table.column(i), pattern='\x1f', replacement='')
+            table = table.set_column(i, field, column)
+    return table
+
+def build_row_converter(fill_values):
+    """按列生成专用的行转换函数（运行时代码生成），每列直接内联对应的空值填充值"""
+    items = [f"{fill!r} if row[{i}] is None else row[{i}]" for i, fill in enumerate(fill_values)]
+    source = "def convert(row):\n    return (" + ", ".join(items) + ",)\n"
+    namespace = {}
+    exec(source, namespace)
+    return namespace['convert']
+
+def clean_rows(rows, fill_values):
+    """逐行处理空值：字符串列替换为''，数值列替换为0"""
+    return map(build_row_converter(fill_values), rows)
+
+def write_chunk_xlsx(filename, columns, rows_iter, compress_level=DEFAULT_XLSX_COMPRESS_LEVEL):
+    """使用openpyxl只写模式流式写入Excel，避免逐单元格构建完整工作簿"""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(columns)
+    for row in rows_iter:
+        ws.append(row)
+    # 自行创建ZIP容器以控制压缩级别（openpyxl默认固定使用deflate）
+    if compress_level == 0:
+        archive = ZipFile(filename, 'w', ZIP_STORED, allowZip64=True)
+    else:
+        archive = ZipFile(filename, 'w', ZIP_DEFLATED, allowZip64=True, compresslevel=compress_level)
+    ExcelWriter(wb, archive).save()
+
+def fetch_chunks(cursor, chunk_size, pbar):
+    """按arraysize批量获取数据并组装为不超过chunk_size行的分块，避免逐行迭代游标"""
+    chunk = []
+    while True:
+        rows = cursor.fetchmany(cursor.arraysize)
+        if not rows:
+            break
+        pbar.update(len(rows))
+        while rows:
+            take = chunk_size - len(chunk)
+            if len(rows) <= take:
+                chunk.extend(rows)
+                rows = []
+            else:
+                chunk.extend(rows[:take])
+                rows = rows[take:]
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def export_chunk_xlsx(filename, columns, rows, fill_values, compress_level):
+    """子进程任务：处理空值后写入一个Excel分块文件"""
+    write_chunk_xlsx(filename, columns, clean_rows(rows, fill_values), compress_level)
+    return filename
+
+def remove_stale_xlsx(output_base):
+    """删除上次运行遗留的 output.xlsx 与 output_NNN.xlsx，避免与本次结果混淆"""
+    stale_files = [f"{output_base}.xlsx"] + [
+        path for path in glob.glob(f"{output_base}_*.xlsx")
+        if path[len(output_base) + 1:-len(".xlsx")].isdigit()
+    ]
+    for path in stale_files:
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"已删除旧文件：{path}")
+
+def export_chunks_parallel(chunks, output_base, columns, fill_values, compress_level):
+    """多个分块时由子进程并行写入 output_NNN.xlsx 并返回文件名列表，任一分块失败则停止并删除已写入的分块"""
+    # 主进程持续获取数据，Excel写入（CPU密集的XML生成）交由子进程并行完成
+    max_workers = max(1, min(MAX_PENDING_CHUNKS, (os.cpu_count() or 2) - 1))
+    pending = threading.BoundedSemaphore(MAX_PENDING_CHUNKS)
+    failed = threading.Event()
+    futures = []
+    file_counter = 1
+
+    def on_chunk_done(future):
+        """分块写入结束回调：释放等待名额，写入失败时通知主进程停止取数"""
+        if future.cancelled() or future.exception() is not None:
+            failed.set()
+        pending.release()
+
+    # 统一使用spawn方式启动子进程，避免在已有会话池和线程的进程中fork
+    mp_context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+        try:
+            for chunk in chunks:
+                pending.acquire()               # 等待中的分块达到上限时暂停取数
+                if failed.is_set():
+                    break                       # 已有分块写入失败，停止取数
+                filename = f"{output_base}_{file_counter:03d}.xlsx"
+                future = executor.submit(export_chunk_xlsx, filename, columns, chunk, fill_values, compress_level)
+                future.add_done_callback(on_chunk_done)
+                futures.append(future)
+                file_counter += 1
+            # 按顺序等待各分块写入完成，第一个失败分块的异常在此重新抛出
+            return [future.result() for future in futures]
+        except BaseException:
+            # 取消排队中的分块，删除已写入的文件，避免留下不完整的分块序列
+            executor.shutdown(cancel_futures=True)
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    os.remove(future.result())
+                    logger.info(f"导出失败，已删除不完整的分块文件：{future.result()}")
+            raise
+
+def export_to_xlsx(cursor, sql, compress_level=DEFAULT_XLSX_COMPRESS_LEVEL):
+    """执行查询并流式分块导出Excel文件"""
+    # 单次执行查询，流式分块导出（每20万行一个文件，不再预先执行COUNT）
+    cursor.execute(sql)
+    columns = [desc[0] for desc in cursor.description]
+    # 按列类型一次性计算空值填充值，避免逐单元格判断类型
+    fill_values = [0 if desc[1] in NUMERIC_TYPES else '' for desc in cursor.description]
+    output_base = "output"      # 文件名前缀
+    remove_stale_xlsx(output_base)
+
+    filenames = []
+    with tqdm(unit='rows', mininterval=0.5) as pbar:
+        chunks = fetch_chunks(cursor, SPLIT_SIZE, pbar)
+        first_chunk = next(chunks, [])
+        second_chunk = next(chunks, None) if first_chunk else None
+        if second_chunk is None:
+            # 结果不超过一个分块：直接在主进程写入 output.xlsx，无需启动子进程
+            write_chunk_xlsx(f"{output_base}.xlsx", columns, clean_rows(first_chunk, fill_values), compress_level)
+        else:
+            filenames = export_chunks_parallel(itertools.chain([first_chunk, second_chunk], chunks),
+                                   output_base, columns, fill_values, compress_level)
+
+    for filename in filenames:
+        logger.info(f"已保存文件：{filename}")
+    if not first_chunk:
+        logger.info(f"查询结果为空，已导出表头到 {output_base}.xlsx")
+    elif second_chunk is None:
+        logger.info(f"数据已导出到 {output_base}.xlsx")
+
+def export_to_parquet(connection, sql, filename="output.parquet"):
+    """以Arrow批次获取查询结果，流式写入单个Parquet文件（zstd压缩）"""
+    # 先写入临时文件，全部批次成功后再替换正式文件，避免中途出错留下不完整的结果
+    tmp_filename = f"{filename}.tmp"
+    writer = None
     try:
-        parsed = sqlparse.parse(sql)
-        if not parsed:
-            raise ValueError("无效的 SQL 语句")
-    except Exception as e:
-        logging.error(f"SQL 校验失败: {e}")
+        with tqdm(unit='rows', mininterval=0.5) as pbar:
+            for odf in connection.fetch_df_batches(statement=sql, size=ARRAY_SIZE):
+                table = pa.Table.from_arrays(odf.column_arrays(), names=odf.column_names())
+                table = strip_unit_separator_table(table)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_filename, table.schema, compression='zstd')
+                writer.write_table(table)
+                pbar.update(table.num_rows)
+        if writer:
+            writer.close()
+    except BaseException:
+        # 导出失败：关闭写入器并删除临时文件后重新抛出
+        if writer:
+            writer.close()
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
         raise
+    if writer:
+        os.replace(tmp_filename, filename)
+        logger.info(f"数据已导出到 {filename}")
+    else:
+        # 删除上次运行遗留的文件，避免被误认为本次结果
+        if os.path.exists(filename):
+            os.remove(filename)
+        logger.info(f"查询结果为空，未生成Parquet文件（已删除旧的 {filename}）")
+
+_client_initialized = False    # Oracle Client 是否已初始化（同一进程只需初始化一次）
+POOL = None                    # 数据库会话池（首次查询时创建，后续查询复用已认证会话）
+
+def init_oracle_client():
+    """初始化 Oracle Client（必须用于厚模式连接），重复调用时直接返回"""
+    global _client_initialized
+    if _client_initialized:
+        return
+    try:
+        oracledb.init_oracle_client(lib_dir=LIB_DIR)
+        logger.info("Oracle Client 初始化成功！路径：{}".format(LIB_DIR))
+    except oracledb.ProgrammingError as e:
+        # 当前进程已用其他参数初始化过 Oracle Client，沿用已有的初始化
+        logger.warning(f"Oracle Client 已初始化，沿用现有配置: {e}")
+    _client_initialized = True
+
+def get_pool(db_config):
+    """获取数据库会话池，不存在时初始化 Oracle Client 并创建"""
+    global POOL
+    if POOL is None:
+        init_oracle_client()
+        # oracle数据库版本在12.1以上可使用瘦连接和厚连接两种方式，在12.1版本以下只能使用厚连接方式
+        POOL = oracledb.create_pool(
+            user=db_config['user'],
+            password=db_config['password'],
+            dsn=db_config['dsn'],
+            min=1,
+            max=4,
+            increment=1,
+            stmtcachesize=40
+        )
+    return POOL
+
+def close_pool():
+    """关闭数据库会话池"""
+    global POOL
+    if POOL is not None:
+        POOL.close()
+        POOL = None
+        logger.debug("数据库会话池已关闭")
 
 def execute_query_and_export_to_excel(sql):
     """核心执行函数：数据库查询与结果导出"""
     connection = None
     cursor = None
     try:
-        if getattr(sys, 'frozen', False):
-            # 当前是打包后的 EXE，使用 PyInstaller 的临时目录
-            base_dir = sys._MEIPASS
-        else:
-            base_dir = os.path.abspath(".")
-        lib_dir = os.path.join(base_dir, "instantclient_11_2")
-
-        # 初始化 Oracle Client（必须用于厚模式连接）
-        oracledb.init_oracle_client(lib_dir=lib_dir)
-        logging.info("Oracle Client 初始化成功！路径：{}".format(lib_dir))
-
         # 数据库连接参数配置
         db_config = read_db_config()
-       # oracle数据库版本在12.1以上可使用瘦连接和厚连接两种方式，在12.1版本以下只能使用厚连接方式
-        connection = oracledb.connect(
-            user=db_config['user'],
-            password=db_config['password'],
-            dsn=db_config['dsn']
-        )
-        cursor = connection.cursor()
-        cursor.arraysize = 10000        # 设置批量获取行数（优化大数据量查询）
-
-        # SQL语法验证
-        validate_sql(sql)
-
-        # 计算总行数（性能优化：避免全表拉取）
-        count_sql = f"SELECT COUNT(1) FROM ({sql})"
-        cursor.execute(count_sql)
-        total_rows = cursor.fetchone()[0]
-        logging.info(f"总行数: {total_rows}")
-
-        if total_rows <= 500_000:
-            # 小数据量处理：一次性导出
-            cursor.close()              # 关闭当前游标
-            cursor = connection.cursor()# 创建新游标执行主查询
-            cursor.arraysize = 10000
-            cursor.execute(sql)
-            columns = [desc[0] for desc in cursor.description]  # 获取列名
-            data = cursor.fetchall()          # 获取所有数据
-            df = pd.DataFrame(data, columns=columns)
-            # 处理空值：字符串列替换为''，数值列替换为0
-            # 优化：使用向量化字符串替换
-            for col in df.columns:
-                if df[col].dtype == 'object' or df[col].dtype.name == 'string':
-                    df[col] = df[col].astype(str).str.replace('\x1f', '', regex=False)
-            # 处理空值：字符串列替换为空字符串，数值列替换为0
-            fill_dict = {col: '' if df[col].dtype == 'object' else 0 for col in df.columns}
-            df = df.fillna(fill_dict)
-            df = df.fillna(fill_dict)
-            df.to_excel(                     # 补全文件名参数
-                "output.xlsx",               # 显式指定文件名
-                index=False,
-                engine='openpyxl'            # 保留XLSX格式支持
-            )
-            logging.info("数据已导出到 output.xlsx")
-        else:
-            # 大数据量处理：分块导出
-            cursor.close()
+        output_format = db_config.get('output_format', 'parquet').strip().lower()
+        connection = get_pool(db_config).acquire()
+
+        # 默认导出Parquet，仅在配置 output_format=xlsx 时导出Excel
+        if output_format == 'parquet':
+            export_to_parquet(connection, sql)
+        elif output_format == 'xlsx':
+            compress_level = int(db_config.get('xlsx_compress_level', DEFAULT_XLSX_COMPRESS_LEVEL))
+            if not 0 <= compress_level <= 9:
+                raise ValueError(f"xlsx_compress_level 取值应为0-9: {compress_level}")
             cursor = connection.cursor()
-            cursor.arraysize = 10000
-            cursor.execute(sql)
-            columns = [desc[0] for desc in cursor.description]
-            output_base = "output"      # 文件名前缀
-            split_size = 200_000        # 每个分块最大行数
-            current_chunk = []
-            current_count = 0
-            file_counter = 1
-
-            # 使用tqdm显示进度条
-            for row in tqdm(cursor, total=total_rows):
-                try:
-                    current_chunk.append(row)
-                    current_count += 1
-                except Exception as e:
-                    logging.error(f"数据行 {current_count} 处理失败: 字段名: {columns} 数据: {row}，错误信息: {e} ")
-                if current_count >= split_size:
-                    # 分块导出并重置计数器
-                    df = pd.DataFrame(current_chunk, columns=columns)
-                    # 优化：使用向量化字符串替换
-                    for col in df.columns:
-                        if df[col].dtype == 'object' or df[col].dtype.name == 'string':
-                            df[col] = df[col].astype(str).str.replace('\x1f', '', regex=False)
-                    # 处理空值：字符串列替换为空字符串，数值列替换为0
-                    df = df.fillna({col: '' if df[col].dtype == 'object' else 0 for col in df.columns})
-                    filename = f"{output_base}_{file_counter:03d}.xlsx"
-                    df.to_excel(
-                        filename,
-                        index=False,
-                        engine='openpyxl'            # 保留XLSX格式支持
-                    )
-                    logging.info(f"已保存文件：{filename}")
-
-                    current_chunk = []
-                    current_count = 0
-                    file_counter += 1
-
-            # 处理剩余数据
-            if current_chunk:
-                filename = f"{output_base}_{file_counter:03d}.xlsx"
-                df = pd.DataFrame(current_chunk, columns=columns)
-                df = df.map(lambda x: str(x).replace('\x1f', '') if isinstance(x, str) else x)
-                # 处理空值：字符串列替换为''，数值列替换为0
-                fill_dict = {col: '' if df[col].dtype == 'object' else 0 for col in df.columns}
-                df = df.fillna(fill_dict)
-                df.to_excel(
-                    filename,
-                    index=False,
-                    engine='openpyxl'
-                )
-                logging.info(f"已保存文件：{filename}")
+            cursor.arraysize = ARRAY_SIZE        # 设置批量获取行数（优化大数据量查询）
+            cursor.prefetchrows = PREFETCH_ROWS
+            cursor.outputtypehandler = output_type_handler
+            export_to_xlsx(cursor, sql, compress_level)
+        else:
+            raise ValueError(f"不支持的导出格式: {output_format}（可选 parquet / xlsx）")
 
     except oracledb.DatabaseError as e:
         line_num = traceback.extract_tb(sys.exc_info()[2])[-1].lineno
-        logging.error(f"数据库连接错误: {str(e)}")
+        logger.error(f"数据库连接错误: {str(e)}")
     except ValueError as e:
         line_num = traceback.extract_tb(sys.exc_info()[2])[-1].lineno
-        logging.error(f"数据格式错误: {str(e)}")
+        logger.error(f"数据格式错误: {str(e)}")
     except Exception as e:
         line_num = traceback.extract_tb(sys.exc_info()[2])[-1].lineno
-        logging.error(f"行 {line_num} - 列 {columns} - 数据行 {str(row)} - 错误: {str(e)}")
+        logger.error(f"行 {line_num} - 错误: {str(e)}")
     finally:
         # 资源释放保障（无论是否发生异常）
         if cursor:
             cursor.close()
-            logging.debug("游标已关闭")
+            logger.debug("游标已关闭")
         if connection:
-            connection.close()
-            logging.debug("数据库连接已关闭")
+            POOL.release(connection)
+            logger.debug("数据库连接已归还会话池")
 
 if __name__ == "__main__":
     """主程序入口"""
+    multiprocessing.freeze_support()    # 支持打包后的EXE启动子进程
+    setup_logging()                     # 仅主进程初始化日志，避免子进程重复创建日志文件
     sql_file = "params.txt"             # SQL参数文件路径
     sql = read_sql_from_file(sql_file)  # 获取SQL查询语句
-    execute_query_and_export_to_excel(sql)  # 执行查询与导出流程
\ No newline at end of file
+    try:
+        execute_query_and_export_to_excel(sql)  # 执行查询与导出流程
+    finally:
+        close_pool()
\ No newline at end of file
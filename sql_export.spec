@@ -8,7 +8,7 @@ a = Analysis(
     pathex=['.'],
     binaries=[],
     datas=[('instantclient_11_2', 'instantclient_11_2')],  # 包含 Oracle Instant Client 目录
-    hiddenimports=['sqlparse', 'tqdm', 'pandas', 'oracledb'],
+    hiddenimports=['tqdm', 'openpyxl', 'pyarrow', 'oracledb'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -8,7 +8,7 @@ a = Analysis(
     pathex=['.'],
     binaries=[],
     datas=[],  
-    hiddenimports=['sqlparse', 'tqdm', 'pandas', 'oracledb'],
+    hiddenimports=['tqdm', 'openpyxl', 'pyarrow', 'oracledb'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],